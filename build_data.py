@@ -1,9 +1,24 @@
-import re, json, time, zipfile, shutil, requests
+import io, os, re, json, time, zipfile, shutil, hashlib, threading, multiprocessing, requests
 import pandas as pd, numpy as np
 from pathlib import Path
+from typing import Optional
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse
 import logging
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional: harvest ids fall back to HARVEST_RE
+    LexborHTMLParser = None
+
+try:
+    import pyarrow as pa, pyarrow.csv as pacsv, pyarrow.compute as pc
+except ImportError:  # optional: falls back to the pandas CSV reader/writer
+    pa = pacsv = pc = None
+
 
 # ============================================================
 # LOGGER
@@ -19,6 +34,14 @@ OUT = Path("output/alternative/sec/failstodeliver")
 PREFIXES = ("cnsfails", "cnsp_sec")
 BASE_URL = "https://catalog.data.gov/dataset/fails-to-deliver-data"
 LEDGER_PATH = Path("previous.json")
+STATE_DIR = LEDGER_PATH.parent / "state" / "failstodeliver"  # merge digests, kept out of OUT
+# period archives must stay YYYYMMDD.zip#YYYYMMDD.csv (DEFLATE): the LEAN readers
+# in SECFailsToDeliver*.cs open them through the zip source, which has no zstd codec
+ZIP_COMPRESSLEVEL = 1  # DEFLATE level for period archives; CSV still packs well at 1
+
+HARVEST_RE = re.compile(r'href="/harvest/object/([a-f0-9\-]+)"', re.I)
+HARVEST_HREF_RE = re.compile(r"/harvest/object/([a-f0-9\-]+)", re.I)  # whole href, same rule
+ZIP_URL_RE = re.compile(r'https://www\.sec\.gov/files/[^\s"<>]+?\.zip\b', re.I)
 
 # ============================================================
 # LEDGER
@@ -30,20 +53,24 @@ class Ledger:
         self.state = self._load()
 
     def _load(self):
+        state = {"downloaded": []}
         if self.path.exists():
             try:
-                return json.loads(self.path.read_text(encoding="utf-8"))
+                state = json.loads(self.path.read_text(encoding="utf-8"))
             except Exception:
-                return {"downloaded": []}
-        return {"downloaded": []}
+                pass
+        state["downloaded"] = set(state.get("downloaded", []))
+        return state
 
     def save(self):
-        self.path.write_text(json.dumps(self.state, indent=2), encoding="utf-8")
+        # atomic: write a sibling tmp file, then swap it in
+        data = {**self.state, "downloaded": sorted(self.state["downloaded"])}
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        tmp.replace(self.path)
 
     def add(self, url: str):
-        if url not in self.state["downloaded"]:
-            self.state["downloaded"].append(url)
-            self.save()
+        self.state["downloaded"].add(url)
 
     def contains(self, url: str) -> bool:
         return url in self.state["downloaded"]
@@ -67,43 +94,75 @@ class SECDownloader:
             "Connection": "keep-alive",
         })
 
+        # one pooled adapter so harvest pages and zip downloads reuse TCP+TLS connections
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+        )
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
+
     def get(self, url: str, **kw):
         return self.s.get(url, **kw)
 
 
+# spaces calls at least 1/rate seconds apart, shared across worker threads
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
 # ============================================================
 # METADATA EXTRACTION
 # ============================================================
 
 class MetadataExtractor:
-    def __init__(self, downloader: SECDownloader):
+    def __init__(self, downloader: SECDownloader, workers: int = 16, rate: float = 10.0):
         self.dl = downloader
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
 
     def get_harvest_ids(self) -> list[str]:
         log.info(f"🔎 fetching harvest metadata list from {self.dl.base_url}")
         html = self.dl.get(self.dl.base_url, timeout=30).text
-        ids = re.findall(r'href="/harvest/object/([a-f0-9\-]+)"', html, re.I)
+        if LexborHTMLParser is not None:
+            links = LexborHTMLParser(html).css('a[href^="/harvest/object/"]')
+            matches = (HARVEST_HREF_RE.fullmatch(a.attributes.get("href") or "") for a in links)
+            ids = [m.group(1) for m in matches if m]
+        else:
+            ids = HARVEST_RE.findall(html)
         ids = list(dict.fromkeys(ids))
         log.info(f"Found {len(ids)} harvest objects")
         return ids
 
+    def _fetch_meta(self, hid: str) -> list[str]:
+        meta_url = f"https://catalog.data.gov/harvest/object/{hid}"
+        try:
+            self.limiter.wait()
+            r = self.dl.get(meta_url, timeout=30)
+            r.raise_for_status()
+            # harvest objects are raw JSON/XML metadata, not HTML: the URLs are plain text
+            return ZIP_URL_RE.findall(r.text)
+        except Exception:
+            return []
+
     def extract_zip_urls(self, harvest_ids: list[str]) -> list[str]:
         zip_urls = []
 
-        for hid in harvest_ids:
-            meta_url = f"https://catalog.data.gov/harvest/object/{hid}"
-            try:
-                r = self.dl.get(meta_url, timeout=30)
-                r.raise_for_status()
-                found = re.findall(
-                    r'https://www\.sec\.gov/files/[^\s"<>]+?\.zip\b',
-                    r.text,
-                    re.I
-                )
+        with ThreadPoolExecutor(max_workers=self.workers) as ex:
+            for found in ex.map(self._fetch_meta, harvest_ids):
                 zip_urls.extend(found)
-                time.sleep(0.2)
-            except Exception:
-                continue
 
         zip_urls = list(dict.fromkeys(zip_urls))
         log.info(f"📦 Found {len(zip_urls)} SEC zip files total")
@@ -116,55 +175,68 @@ class MetadataExtractor:
 # ============================================================
 
 class ZipFetcher:
-    def __init__(self, dl: SECDownloader, ledger: Ledger, out_dir: Path):
+    FLUSH_EVERY = 16  # ledger writes are batched; a crash re-downloads at most this many
+
+    def __init__(self, dl: SECDownloader, ledger: Ledger, out_dir: Path, workers: int = 4, rate: float = 2.0):
         self.dl = dl
         self.ledger = ledger
         self.out = out_dir
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.lock = threading.Lock()
+        self.unsaved = 0
+
+    def _download(self, url: str):
+        fn = Path(urlparse(url).path).name or "file.zip"
+        fp = self.out / fn
+
+        log.info(f"⬇ downloading {fn}")
+        self.limiter.wait()
+
+        try:
+            r = self.dl.get(url, stream=True, timeout=120)
+            if r.status_code == 403:
+                r.close()
+                r = self.dl.get(
+                    url,
+                    headers={"Referer": "https://www.sec.gov/files/data/fails-deliver-data/"},
+                    stream=True,
+                    timeout=120,
+                )
 
-    def download_all(self, urls: list[str]):
-        for url in urls:
-            if self.ledger.contains(url):
-                continue
-
-            fn = Path(urlparse(url).path).name or "file.zip"
-            fp = self.out / fn
+            r.raise_for_status()
 
-            log.info(f"⬇ downloading {fn}")
-            time.sleep(0.5)
+            with fp.open("wb") as f:
+                for chunk in r.iter_content(262144):
+                    if chunk:
+                        f.write(chunk)
 
-            try:
-                r = self.dl.get(url, stream=True, timeout=120)
-                if r.status_code == 403:
-                    r.close()
-                    r = self.dl.get(
-                        url,
-                        headers={"Referer": "https://www.sec.gov/files/data/fails-deliver-data/"},
-                        stream=True,
-                        timeout=120,
-                    )
-
-                r.raise_for_status()
-
-                with fp.open("wb") as f:
-                    for chunk in r.iter_content(262144):
-                        if chunk:
-                            f.write(chunk)
-
-                if fp.stat().st_size > 0:
-                    # atomic ledger update
-                    self.ledger.state["downloaded"].append(url)
-
-                    tmp = self.ledger.path.with_suffix(".tmp")
-                    tmp.write_text(json.dumps(self.ledger.state, indent=2), encoding="utf-8")
-                    tmp.replace(self.ledger.path)
-
-                    log.info(f"✔ ledger updated ({url})")
-                else:
-                    fp.unlink(missing_ok=True)
+            if fp.stat().st_size > 0:
+                with self.lock:
+                    self.ledger.add(url)
+                    self.unsaved += 1
+                    if self.unsaved >= self.FLUSH_EVERY:
+                        self.ledger.save()
+                        self.unsaved = 0
 
-            except Exception:
+                log.info(f"✔ ledger updated ({url})")
+            else:
                 fp.unlink(missing_ok=True)
-                continue
+
+        except Exception:
+            fp.unlink(missing_ok=True)
+
+    def download_all(self, urls: list[str]):
+        todo = [url for url in urls if not self.ledger.contains(url)]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as ex:
+                list(ex.map(self._download, todo))
+        finally:
+            with self.lock:
+                if self.unsaved:
+                    self.ledger.save()
+                    self.unsaved = 0
 
 
 # ============================================================
@@ -198,43 +270,102 @@ class Unzipper:
 
 class Cleaner:
     @staticmethod
-    def fix_lines(path: Path) -> pd.DataFrame:
-        for enc in ("utf-8", "cp1252", "latin1"):
-            try:
-                text = path.read_text(encoding=enc, errors="replace")
-                break
-            except Exception:
-                continue
-        else:
-            return pd.DataFrame()
+    def fix_lines_arrow(path: Path) -> pd.DataFrame:
+        # well-formed 6-field rows go through Arrow's multithreaded reader; the rare rows
+        # with interior "|" in the name arrive via invalid_row_handler and are folded here
+        with path.open("rb") as f:
+            first = f.readline().decode("utf-8", errors="replace")
+        header = [h.strip() for h in first.split("|")]
+        if len(header) != 6:
+            raise ValueError(f"unexpected header in {path.name}")
+
+        names = [f"c{i}" for i in range(6)]
+        misaligned: list[str] = []
+
+        def on_invalid(row):
+            misaligned.append(row.text)
+            return "skip"
+
+        tbl = pacsv.read_csv(
+            path,
+            read_options=pacsv.ReadOptions(column_names=names, skip_rows=1),
+            parse_options=pacsv.ParseOptions(delimiter="|", quote_char=False, invalid_row_handler=on_invalid),
+            convert_options=pacsv.ConvertOptions(
+                column_types={c: pa.string() for c in names},
+                strings_can_be_null=False,
+            ),
+        )
+        tbl = pa.table([pc.utf8_trim_whitespace(tbl[c]) for c in names], names=header)
+        tbl = tbl.filter(pc.not_equal(tbl[header[1]], ""))
 
-        lines = text.splitlines()
-        if not lines:
-            return pd.DataFrame()
-
-        header = [h.strip() for h in lines[0].split("|")][:6]
         rows = []
-
-        for ln in lines[1:]:
+        for ln in misaligned:
             parts = [s.strip() for s in ln.split("|")]
-            n = len(parts)
-
-            if n == 6:
-                row = parts
-            elif n == 7:
-                parts[4] = f"{parts[4]}-{parts[5]}"
-                row = parts[:5] + [parts[6]]
-            elif n > 7:
-                row = parts[:4] + ["-".join(parts[4:-1]), parts[-1]]
-            else:
+            if len(parts) < 7 or not parts[1]:
                 continue
+            rows.append(parts[:4] + ["-".join(parts[4:-1]), parts[-1]])
 
-            if not row[1].strip():
-                continue
+        df = tbl.to_pandas()
+        if rows:
+            df = pd.concat([df, pd.DataFrame(rows, columns=header)], ignore_index=True)
+        return df
 
-            rows.append(row)
+    @staticmethod
+    def fix_lines(path: Path) -> pd.DataFrame:
+        if pacsv is not None:
+            try:
+                return Cleaner.fix_lines_arrow(path)
+            except (pa.ArrowInvalid, ValueError, OSError):
+                pass  # empty file, bad header or undecodable bytes: the pandas reader copes
 
-        return pd.DataFrame(rows, columns=header)
+        try:
+            buf = path.read_bytes()
+        except OSError:
+            return pd.DataFrame()
+        if not buf.strip():
+            return pd.DataFrame()
+
+        # real field count per line: "|" bytes between "\n" bytes (single bytes in utf-8
+        # and cp1252), so an empty trailing field never hides a separator
+        b = np.frombuffer(buf, dtype=np.uint8)
+        ends = np.flatnonzero(b == 10)
+        if b[-1] != 10:
+            ends = np.append(ends, len(b) - 1)
+        n = np.diff(np.cumsum(b == 124)[ends], prepend=0) + 1
+
+        raw = pd.read_csv(
+            io.BytesIO(buf),
+            sep="|",
+            header=None,
+            names=range(int(n.max())),
+            engine="c",
+            dtype=object,
+            quoting=3,
+            na_filter=False,
+            lineterminator="\n",
+            skip_blank_lines=False,
+            encoding="utf-8",
+            encoding_errors="replace",
+        )
+        vals = raw.to_numpy(dtype=object)
+
+        header = [h.strip() for h in vals[0, :6]]
+        if vals.shape[1] < 6:
+            return pd.DataFrame(columns=header)
+        body, n = vals[1:], n[1:]
+
+        out = body[:, :6].copy()
+        out[:, 5] = body[np.arange(len(body)), np.maximum(n - 1, 0)]
+        # interior "|" in the name (rare): fold fields 4..n-2 into the name
+        for r in np.flatnonzero(n >= 7):
+            out[r, 4] = "-".join(s.strip() for s in body[r, 4:n[r] - 1])
+
+        df = pd.DataFrame(out, columns=header)
+        for i in range(6):
+            df.isetitem(i, df.iloc[:, i].str.strip())
+
+        keep = (n >= 6) & (df.iloc[:, 1] != "").to_numpy()
+        return df[keep].reset_index(drop=True)
 
     @staticmethod
     def is_equity_cusip(cusip: str) -> bool:
@@ -242,87 +373,222 @@ class Cleaner:
         return len(c) >= 8 and c[0] == "0" and c[6:8] == "10"
 
     @staticmethod
-    def offset_date(d):
-        if pd.isna(d):
-            return pd.NaT
-        return (d + pd.offsets.MonthEnd(0)) if d.day <= 15 else (d + pd.offsets.MonthBegin(1)).replace(day=15)
-
-
-class Aggregator:
-    def __init__(self, out_dir: Path):
-        self.out = out_dir
-        self.cleaner = Cleaner()
+    def parse_dates(s: pd.Series) -> pd.Series:
+        # a file spans a handful of settlement dates: parse each distinct string once
+        codes, uniques = pd.factorize(s)
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format="%Y%m%d", errors="coerce").to_numpy()
+        parsed = np.append(parsed, np.datetime64("NaT"))  # code -1 (missing) lands here
+        return pd.Series(parsed[codes], index=s.index)
 
-    def run(self):
-        for p in self.out.iterdir():
-            if not p.is_file() or p.suffix.lower() not in (".txt", "", ".csv"):
-                continue
+    @staticmethod
+    def format_dates(d: pd.Series) -> pd.Series:
+        # same trick the other way round: strftime each distinct date once
+        codes, uniques = pd.factorize(d)
+        text = np.append(pd.DatetimeIndex(uniques).strftime("%Y%m%d").to_numpy(dtype=object), "")
+        return pd.Series(text[codes], index=d.index)
 
-            df = self.cleaner.fix_lines(p)
-            if df.empty:
-                p.unlink(missing_ok=True)
-                continue
+    @staticmethod
+    def offset_date(d: pd.Series) -> pd.Series:
+        month_end = d + pd.offsets.MonthEnd(0)
+        next_mid = (d + pd.offsets.MonthBegin(1)) + pd.Timedelta(days=14)
+        return month_end.where(d.dt.day <= 15, next_mid)
 
-            if "PRICE" in df.columns:
-                df["PRICE"] = pd.to_numeric(df["PRICE"], errors="coerce")
-                df = df[df["PRICE"].notna() & (df["PRICE"] != 0)]
 
-            if "QUANTITY (FAILS)" in df.columns:
-                df["QUANTITY (FAILS)"] = pd.to_numeric(df["QUANTITY (FAILS)"], errors="coerce")
+class Aggregator:
+    OUT_COLS = ["DATE", "SYMBOL", "QUANTITY (FAILS)", "PRICE"]
+    BATCH_FILES = 8  # source files merged per write pass
+    BATCH_ROWS = 5_000_000  # ...or fewer, once this many cleaned rows are pending
+    SEEN_MAX = 64  # digests remembered per period; older ones only cost a re-merge
 
-            req = ["CUSIP", "SYMBOL", "SETTLEMENT DATE", "QUANTITY (FAILS)", "PRICE"]
-            if not all(c in df.columns for c in req):
-                p.unlink(missing_ok=True)
-                continue
+    def __init__(self, out_dir: Path, state_dir: Path):
+        self.out = out_dir
+        self.state = state_dir
+        self.state.mkdir(parents=True, exist_ok=True)
+        self.cleaner = Cleaner()
 
-            df["CUSIP"] = df["CUSIP"].astype(str)
-            df = df[df["CUSIP"].apply(self.cleaner.is_equity_cusip)]
-            if df.empty:
-                p.unlink(missing_ok=True)
-                continue
+    @staticmethod
+    def format_rows(data: pd.DataFrame) -> pd.DataFrame:
+        q = data["QUANTITY (FAILS)"].astype(float).to_numpy()
+        p = data["PRICE"].astype(float).to_numpy()
+        with np.errstate(invalid="ignore"):
+            integral = np.isfinite(q) & (np.mod(q, 1) == 0)
+        q_int = integral & (np.abs(q) < 2**63)  # fits int64 without wrapping
+
+        q_str = np.where(q_int, np.char.mod("%d", np.where(q_int, q, 0).astype("int64")), np.char.mod("%.2f", q))
+        q_str = q_str.astype(object)
+        big = integral & ~q_int
+        q_str[big] = [str(int(v)) for v in q[big]]  # rare: exact Python ints, as before
+        q_str[np.isnan(q)] = ""
+        p_str = np.where(np.isnan(p), "", np.char.mod("%.2f", p))
+
+        return pd.DataFrame({
+            "DATE": data["DATE"].astype(str).to_numpy(),
+            "SYMBOL": data["SYMBOL"].astype(str).to_numpy(),
+            "QUANTITY (FAILS)": q_str,
+            "PRICE": p_str,
+        })
 
-            df["SETTLEMENT DATE"] = pd.to_datetime(df["SETTLEMENT DATE"], format="%Y%m%d", errors="coerce")
-            df = df[df["SETTLEMENT DATE"] >= pd.Timestamp("2009-07-01")]
-            if df.empty:
-                p.unlink(missing_ok=True)
-                continue
+    @staticmethod
+    def to_csv_bytes(data: pd.DataFrame) -> bytes:
+        if pacsv is not None:
+            try:
+                buf = pa.BufferOutputStream()
+                pacsv.write_csv(
+                    pa.Table.from_pandas(data, preserve_index=False),
+                    buf,
+                    pacsv.WriteOptions(include_header=False, quoting_style="none"),
+                )
+                return buf.getvalue().to_pybytes()
+            except pa.ArrowInvalid:
+                pass  # a value needs quoting; let pandas handle it
+        return data.to_csv(index=False, header=False, lineterminator="\n").encode("utf-8")
 
-            df["OFFSET_DATE"] = df["SETTLEMENT DATE"].apply(self.cleaner.offset_date)
-            df["DATE"] = df["SETTLEMENT DATE"].dt.strftime("%Y%m%d")
+    @staticmethod
+    def digest(data: pd.DataFrame) -> str:
+        # row-order independent fingerprint of a formatted chunk
+        h = np.sort(pd.util.hash_pandas_object(data, index=False).to_numpy())
+        return hashlib.sha256(h.tobytes()).hexdigest()
+
+    def _remember(self, seen_path: Path, seen: list[str], digests: list[str]):
+        seen = [d for d in seen if d not in digests] + list(dict.fromkeys(digests))
+        seen_path.write_text("\n".join(seen[-self.SEEN_MAX:]) + "\n", encoding="utf-8")
+
+    def _emit_period(self, period: str, frames: list[pd.DataFrame]) -> Optional[int]:
+        out_cols = self.OUT_COLS
+        zip_path = self.out / f"{period}.zip"
+        csv_name = f"{period}.csv"
+        seen_path = self.state / f"{period}.sha256"
+
+        # one digest per source file's chunk, so re-runs match however files are batched;
+        # every chunk already merged into this archive: skip read + rewrite
+        digests = [self.digest(f) for f in frames]
+        seen = seen_path.read_text(encoding="utf-8").split() if seen_path.exists() else []
+        if zip_path.exists() and set(digests) <= set(seen):
+            return None
+
+        data = pd.concat(frames, ignore_index=True)
+
+        n_old = 0
+        if zip_path.exists():
+            try:
+                with zipfile.ZipFile(zip_path, "r") as zf:
+                    if csv_name in zf.namelist():
+                        old = pd.read_csv(
+                            zf.open(csv_name),
+                            header=None,
+                            names=out_cols,
+                            dtype=str,
+                            keep_default_na=False,
+                        )
+                        data = pd.concat([old, data], ignore_index=True)
+                        n_old = len(old)
+            except Exception:
+                pass
 
-            out_cols = ["DATE", "SYMBOL", "QUANTITY (FAILS)", "PRICE"]
+        # keep="first" leaves old rows in place; nothing new and no stale duplicates
+        # means the archive already holds exactly this data, so skip the recompress
+        dup = data.duplicated(subset=out_cols, keep="first").to_numpy()
+        unchanged = n_old > 0 and dup[n_old:].all() and not dup[:n_old].any()
+        data = data[~dup].reset_index(drop=True)
 
-            for off_dt, chunk in df.groupby(df["OFFSET_DATE"]):
-                period = pd.to_datetime(off_dt).strftime("%Y%m%d")
-                zip_path = self.out / f"{period}.zip"
-                csv_name = f"{period}.csv"
+        if unchanged:
+            self._remember(seen_path, seen, digests)
+            return None
 
-                data = chunk[out_cols].copy()
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESSLEVEL) as zf:
+            zf.writestr(csv_name, self.to_csv_bytes(data))
 
-                if zip_path.exists():
-                    try:
-                        with zipfile.ZipFile(zip_path, "r") as zf:
-                            if csv_name in zf.namelist():
-                                old = pd.read_csv(zf.open(csv_name), header=None)
-                                old.columns = out_cols[:len(old.columns)]
-                                data = pd.concat([old, data], ignore_index=True).drop_duplicates()
-                    except Exception:
-                        pass
+        self._remember(seen_path, seen, digests)
 
-                lines = []
-                for _, r in data.iterrows():
-                    q = r["QUANTITY (FAILS)"]
-                    q_str = "" if pd.isna(q) else (str(int(q)) if float(q).is_integer() else f"{q:.2f}")
-                    p_str = "" if pd.isna(r["PRICE"]) else f"{r['PRICE']:.2f}"
-                    lines.append(f"{r['DATE']},{r['SYMBOL']},{q_str},{p_str}")
+        return len(data)
 
-                with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                    zf.writestr(csv_name, "\n".join(lines) + "\n")
+    def _flush(self, pending: dict[str, list[pd.DataFrame]], parsed: list[Path], pool: Optional[ProcessPoolExecutor]):
+        # one read + one rewrite per output period, however many files in the batch feed it;
+        # periods touch disjoint files, so compress + write them in parallel processes
+        if pool is not None and len(pending) > 1:
+            results = list(pool.map(self._emit_period, pending.keys(), pending.values()))
+        else:
+            results = [self._emit_period(period, frames) for period, frames in pending.items()]
 
-                log.info(f"✓ {zip_path.name} — {len(data)} rows")
+        for period, rows in zip(pending, results):
+            if rows is None:
+                log.info(f"= {period}.zip unchanged")
+            else:
+                log.info(f"✓ {period}.zip — {rows} rows")
 
+        for p in parsed:
             p.unlink(missing_ok=True)
 
+    def run(self):
+        out_cols = self.OUT_COLS
+        pending: dict[str, list[pd.DataFrame]] = {}
+        parsed: list[Path] = []
+        batch_rows = 0
+
+        # one pool per run, spawned rather than forked: the download and Arrow reader
+        # thread pools have already run in this process. Single-CPU hosts write serially.
+        workers = os.cpu_count() or 1
+        ctx = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx) if workers > 1 else None
+        with pool or nullcontext():
+            for p in self.out.iterdir():
+                if not p.is_file() or p.suffix.lower() not in (".txt", "", ".csv"):
+                    continue
+
+                df = self.cleaner.fix_lines(p)
+                if df.empty:
+                    p.unlink(missing_ok=True)
+                    continue
+
+                if "PRICE" in df.columns:
+                    df["PRICE"] = pd.to_numeric(df["PRICE"], errors="coerce")
+                    df = df[df["PRICE"].notna() & (df["PRICE"] != 0)]
+
+                if "QUANTITY (FAILS)" in df.columns:
+                    df["QUANTITY (FAILS)"] = pd.to_numeric(df["QUANTITY (FAILS)"], errors="coerce")
+
+                req = ["CUSIP", "SYMBOL", "SETTLEMENT DATE", "QUANTITY (FAILS)", "PRICE"]
+                if not all(c in df.columns for c in req):
+                    p.unlink(missing_ok=True)
+                    continue
+
+                # few distinct symbols/CUSIPs per file: filters and hashing run over the categories
+                df["CUSIP"] = df["CUSIP"].astype("category")
+                df["SYMBOL"] = df["SYMBOL"].astype("category")
+
+                # decide once per distinct CUSIP, then broadcast through the category codes
+                cats = df["CUSIP"].cat.categories
+                keep = np.fromiter((self.cleaner.is_equity_cusip(c) for c in cats), dtype=bool, count=len(cats))
+                keep = np.append(keep, False)  # code -1 (missing CUSIP) lands here
+                df = df[keep[df["CUSIP"].cat.codes.to_numpy()]]
+                if df.empty:
+                    p.unlink(missing_ok=True)
+                    continue
+
+                df["SETTLEMENT DATE"] = self.cleaner.parse_dates(df["SETTLEMENT DATE"])
+                df = df[df["SETTLEMENT DATE"] >= pd.Timestamp("2009-07-01")]
+                if df.empty:
+                    p.unlink(missing_ok=True)
+                    continue
+
+                df["OFFSET_DATE"] = self.cleaner.offset_date(df["SETTLEMENT DATE"])
+                df["DATE"] = self.cleaner.format_dates(df["SETTLEMENT DATE"])
+
+                for off_dt, chunk in df.groupby("OFFSET_DATE", sort=False, observed=True):
+                    period = pd.to_datetime(off_dt).strftime("%Y%m%d")
+                    pending.setdefault(period, []).append(self.format_rows(chunk[out_cols]))
+
+                parsed.append(p)
+                batch_rows += len(df)
+
+                # bound memory on large backfills: write what is pending every few files
+                if len(parsed) >= self.BATCH_FILES or batch_rows >= self.BATCH_ROWS:
+                    self._flush(pending, parsed, pool)
+                    pending, parsed, batch_rows = {}, [], 0
+
+            if parsed:
+                self._flush(pending, parsed, pool)
+
 
 
 # ============================================================
@@ -338,7 +604,7 @@ class SECFTDPipeline:
         self.meta = MetadataExtractor(self.downloader)
         self.fetcher = ZipFetcher(self.downloader, self.ledger, OUT)
         self.unzipper = Unzipper(OUT, PREFIXES)
-        self.aggregator = Aggregator(OUT)
+        self.aggregator = Aggregator(OUT, STATE_DIR)
 
     def run(self):
         harvest_ids = self.meta.get_harvest_ids()
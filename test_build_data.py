@@ -0,0 +1,272 @@
+import random
+import warnings
+
+import pandas as pd
+import pytest
+
+import build_data
+from build_data import Cleaner
+
+
+HEADER = "SETTLEMENT DATE|CUSIP|SYMBOL|QUANTITY (FAILS)|DESCRIPTION|PRICE"
+
+
+def reference_fix_lines(path):
+    # the original per-line parser, kept as the behaviour both readers must match
+    lines = path.read_text(encoding="utf-8", errors="replace").splitlines()
+    header = [h.strip() for h in lines[0].split("|")][:6]
+    rows = []
+    for ln in lines[1:]:
+        parts = [s.strip() for s in ln.split("|")]
+        n = len(parts)
+        if n == 6:
+            row = parts
+        elif n == 7:
+            row = parts[:4] + [f"{parts[4]}-{parts[5]}", parts[6]]
+        elif n > 7:
+            row = parts[:4] + ["-".join(parts[4:-1]), parts[-1]]
+        else:
+            continue
+        if not row[1]:
+            continue
+        rows.append(row)
+    return pd.DataFrame(rows, columns=header)
+
+
+def canon(df):
+    return sorted(map(tuple, df.astype(str).to_numpy().tolist()))
+
+
+@pytest.fixture
+def ftd_file(tmp_path):
+    rnd = random.Random(7)
+    lines = [
+        HEADER,
+        "20200102|037833100|AAPL|100|APP|LE|",
+        "20200102|037833100|FND|100|FUND|2025|",
+        "20200102|037833100|MSFT|100|MICRO|SOFT|",
+        "20200102|037833100|WIDE|1|" + "|".join("abcdefghijklmnopqrst") + "|9.5",
+    ]
+    for _ in range(2000):
+        k = rnd.choice([4, 5, 6, 6, 6, 7, 8, 9, 20])
+        parts = [
+            str(20200100 + rnd.randint(1, 28)),
+            rnd.choice(["037833100", " 00036010X ", "", "NA"]),
+            rnd.choice(["AAPL", "NA", " B "]),
+            str(rnd.randint(1, 9999)),
+        ]
+        while len(parts) < k - 1:
+            parts.append(rnd.choice(["CORP", "", "2025", 'A "B"', " N/A "]))
+        parts.append(rnd.choice(["2.73", "", "1", " 5.5 "]))
+        lines.append("|".join(parts[:k]))
+    lines += ["", "Trailer record count 2000"]
+    p = tmp_path / "cnsfails202001a.txt"
+    p.write_text("\r\n".join(lines) + "\r\n", encoding="utf-8")
+    return p
+
+
+def test_pandas_reader_matches_reference(ftd_file, monkeypatch):
+    monkeypatch.setattr(build_data, "pacsv", None)
+    assert canon(Cleaner.fix_lines(ftd_file)) == canon(reference_fix_lines(ftd_file))
+
+
+def test_arrow_reader_matches_pandas_reader(ftd_file, monkeypatch):
+    pytest.importorskip("pyarrow")
+    arrow = Cleaner.fix_lines_arrow(ftd_file)
+    monkeypatch.setattr(build_data, "pacsv", None)
+    assert canon(arrow) == canon(Cleaner.fix_lines(ftd_file))
+
+
+def test_split_name_with_empty_price_keeps_empty_price(ftd_file, monkeypatch):
+    monkeypatch.setattr(build_data, "pacsv", None)
+    df = Cleaner.fix_lines(ftd_file)
+    row = df[df["SYMBOL"] == "FND"].iloc[0]
+    assert (row["DESCRIPTION"], row["PRICE"]) == ("FUND-2025", "")
+
+
+def test_offset_date_matches_scalar_rule():
+    def scalar(d):
+        if pd.isna(d):
+            return pd.NaT
+        return (d + pd.offsets.MonthEnd(0)) if d.day <= 15 else (d + pd.offsets.MonthBegin(1)).replace(day=15)
+
+    days = pd.Series(pd.date_range("2009-01-01", "2030-12-31", freq="D").append(pd.DatetimeIndex([pd.NaT])))
+    assert Cleaner.offset_date(days).equals(days.apply(scalar))
+
+
+HARVEST_PAGE = """
+<a href="/harvest/object/ab12-cd34">a</a>
+<a href="/harvest/object/ab12-cd34/html">b</a>
+<a href="/harvest/object/">c</a>
+<a href="/harvest/object/dead?x=1">d</a>
+<a href="/harvest/object/not-an-id">e</a>
+<a href="/harvest/object/FF00">f</a>
+"""
+
+
+class StubDownloader:
+    base_url = "https://catalog.data.gov/dataset/fails-to-deliver-data"
+
+    def get(self, url, **kw):
+        class Resp:
+            text = HARVEST_PAGE
+        return Resp()
+
+
+def test_harvest_ids_selectolax_matches_regex_rule(monkeypatch):
+    pytest.importorskip("selectolax")
+    ids = build_data.MetadataExtractor(StubDownloader()).get_harvest_ids()
+    monkeypatch.setattr(build_data, "LexborHTMLParser", None)
+    fallback = build_data.MetadataExtractor(StubDownloader()).get_harvest_ids()
+    assert ids == ["ab12-cd34", "FF00"]
+    assert ids == fallback
+
+
+def test_aggregator_batches_merge_into_one_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_data.Aggregator, "BATCH_FILES", 1)
+    for i, day in enumerate(["20200102", "20200103", "20200102"]):
+        (tmp_path / f"cnsfails{i}.txt").write_text(
+            f"{HEADER}\n{day}|037833100|AAPL|100|APPLE INC|75.09\n", encoding="utf-8"
+        )
+
+    build_data.Aggregator(tmp_path, tmp_path / "state").run()
+
+    assert not list(tmp_path.glob("*.txt"))
+    with build_data.zipfile.ZipFile(tmp_path / "20200131.zip") as zf:
+        rows = zf.read("20200131.csv").decode().splitlines()
+    assert sorted(rows) == ["20200102,AAPL,100,75.09", "20200103,AAPL,100,75.09"]
+
+
+def test_format_rows_quantities():
+    data = pd.DataFrame({
+        "DATE": ["20200102"] * 5,
+        "SYMBOL": ["A"] * 5,
+        "QUANTITY (FAILS)": [100.0, 2.5, float("nan"), 1e19, float("inf")],
+        "PRICE": [1.005, 2.0, 3.0, 4.0, float("nan")],
+    })
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        out = build_data.Aggregator.format_rows(data)
+    assert out["QUANTITY (FAILS)"].tolist() == ["100", "2.50", "", "10000000000000000000", "inf"]
+    assert out["PRICE"].tolist() == ["1.00", "2.00", "3.00", "4.00", ""]
+
+
+def write_ftd(path, *rows):
+    path.write_text("\n".join([HEADER, *rows]) + "\n", encoding="utf-8")
+
+
+def archive_rows(path, period):
+    with build_data.zipfile.ZipFile(path / f"{period}.zip") as zf:
+        return sorted(zf.read(f"{period}.csv").decode().splitlines())
+
+
+def test_rerun_of_same_source_skips_rewrite(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_data.os, "cpu_count", lambda: 2)  # two periods: goes through the pool
+    out, state = tmp_path / "out", tmp_path / "state"
+    out.mkdir()
+    rows = ["20200102|037833100|AAPL|100|APPLE INC|75.09", "20200120|037833100|AAPL|5|APPLE INC|77.10"]
+
+    write_ftd(out / "cnsfails202001a.txt", *rows)
+    build_data.Aggregator(out, state).run()
+    mtimes = {z.name: z.stat().st_mtime_ns for z in out.glob("*.zip")}
+
+    write_ftd(out / "cnsfails202001a.txt", *rows)
+    build_data.Aggregator(out, state).run()
+
+    assert sorted(mtimes) == ["20200131.zip", "20200215.zip"]
+    assert {z.name: z.stat().st_mtime_ns for z in out.glob("*.zip")} == mtimes
+    assert sorted(p.name for p in out.iterdir()) == ["20200131.zip", "20200215.zip"]
+    assert len((state / "20200131.sha256").read_text().split()) == 1
+    assert archive_rows(out, "20200131") == ["20200102,AAPL,100,75.09"]
+
+
+def test_merge_rewrites_archive_with_stale_duplicates(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    with build_data.zipfile.ZipFile(out / "20200131.zip", "w") as zf:
+        zf.writestr("20200131.csv", "20200102,AAPL,100,75.09\n20200102,AAPL,100,75.09\n")
+    before = (out / "20200131.zip").stat().st_mtime_ns
+
+    write_ftd(out / "cnsfails202001a.txt", "20200102|037833100|AAPL|100|APPLE INC|75.09")
+    build_data.Aggregator(out, tmp_path / "state").run()
+
+    assert (out / "20200131.zip").stat().st_mtime_ns != before
+    assert archive_rows(out, "20200131") == ["20200102,AAPL,100,75.09"]
+
+
+def test_merge_with_nothing_new_leaves_archive_alone(tmp_path):
+    out, state = tmp_path / "out", tmp_path / "state"
+    out.mkdir()
+    write_ftd(
+        out / "cnsfails202001a.txt",
+        "20200102|037833100|AAPL|100|APPLE INC|75.09",
+        "20200103|037833100|AAPL|200|APPLE INC|76.00",
+    )
+    build_data.Aggregator(out, state).run()
+    before = (out / "20200131.zip").stat().st_mtime_ns
+
+    # a different chunk (new digest) whose rows are all already archived
+    write_ftd(out / "cnsfails202001b.txt", "20200103|037833100|AAPL|200|APPLE INC|76.00")
+    build_data.Aggregator(out, state).run()
+
+    assert (out / "20200131.zip").stat().st_mtime_ns == before
+    assert len((state / "20200131.sha256").read_text().split()) == 2
+
+
+def test_ledger_round_trip(tmp_path):
+    path = tmp_path / "previous.json"
+    path.write_text(build_data.json.dumps({"downloaded": ["https://b/2.zip", "https://a/1.zip"]}))
+
+    ledger = build_data.Ledger(path)
+    assert ledger.contains("https://a/1.zip")
+    ledger.add("https://c/3.zip")
+    assert build_data.json.loads(path.read_text())["downloaded"] == ["https://b/2.zip", "https://a/1.zip"]
+
+    ledger.save()
+    assert build_data.json.loads(path.read_text())["downloaded"] == [
+        "https://a/1.zip", "https://b/2.zip", "https://c/3.zip",
+    ]
+    assert build_data.Ledger(path).state["downloaded"] == {"https://a/1.zip", "https://b/2.zip", "https://c/3.zip"}
+
+
+class Abort(BaseException):
+    pass
+
+
+class StubZipDownloader:
+    def get(self, url, **kw):
+        if url.endswith("boom.zip"):
+            raise Abort()
+
+        class Resp:
+            status_code = 200
+
+            def raise_for_status(self):
+                pass
+
+            def iter_content(self, size):
+                yield b"PK"
+        return Resp()
+
+
+def test_download_all_flushes_ledger_when_a_download_raises(tmp_path):
+    ledger = build_data.Ledger(tmp_path / "previous.json")
+    fetcher = build_data.ZipFetcher(StubZipDownloader(), ledger, tmp_path, workers=1, rate=1000)
+    urls = ["https://www.sec.gov/files/a.zip", "https://www.sec.gov/files/b.zip", "https://www.sec.gov/files/boom.zip"]
+
+    with pytest.raises(Abort):
+        fetcher.download_all(urls)
+
+    saved = build_data.json.loads((tmp_path / "previous.json").read_text())["downloaded"]
+    assert saved == urls[:2]
+
+
+def test_date_parse_and_format_match_per_row_pandas():
+    raw = pd.Series(["20200102", "20200102", "x", "", "20200230", "20191231"] * 20, index=range(5, 125))
+    parsed = Cleaner.parse_dates(raw)
+    assert parsed.equals(pd.to_datetime(raw, format="%Y%m%d", errors="coerce"))
+
+    valid = parsed.dropna()
+    formatted = Cleaner.format_dates(valid)
+    assert list(formatted.index) == list(valid.index)
+    assert formatted.tolist() == valid.dt.strftime("%Y%m%d").tolist()